@@ -1,5 +1,5 @@
 import asyncio
-from collections import Counter
+from collections import Counter, deque
 import concurrent.futures
 import difflib
 import fnmatch
@@ -10,11 +10,11 @@ import importlib
 from importlib.util import find_spec
 import io
 import itertools
+import operator
 import os
 from pathlib import Path
 import re
 import shutil
-import stat
 import subprocess
 import sys
 from tempfile import TemporaryFile
@@ -31,7 +31,7 @@ class Wilder(object):
     def __init__(self, nvim):
         self.nvim = nvim
         self.has_init = False
-        self.events = []
+        self.events = deque()
         self.events_lock = threading.Lock()
         self.executor = None
         self.cached_buffer = {'bufnr': -1, 'undotree_seq_cur': -1, 'buffer': []}
@@ -42,6 +42,10 @@ class Wilder(object):
         self.help_tags_lock = threading.Lock()
         self.help_tags_session_id = -1
         self.help_tags_result = None
+        self.users_lock = threading.Lock()
+        self.users_timestamp = -1
+        self.users_mtime = -1
+        self.users = []
         self.added_sys_path = set()
 
     def resolve(self, ctx, x):
@@ -57,13 +61,32 @@ class Wilder(object):
         self.nvim.call('wilder#reject', ctx, x)
 
     def echomsg(self, x):
-        self.nvim.session.threadsafe_call(lambda: self.nvim.command('echomsg "' + x + '"'))
+        # escape as a double quoted Vim string so quotes in x cannot break the command
+        x = x.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        self.nvim.session.threadsafe_call(lambda: self.nvim.command(f'echomsg "{x}"'))
+
+    # Cached so that repeated queries skip compilation and a pattern which
+    # falls back to re is only reported once
+    @functools.lru_cache(maxsize=128)
+    def compile_pattern(self, module_name, pattern):
+        re = importlib.import_module(module_name)
+
+        try:
+            # re2 does not use re.UNICODE by default
+            return re.compile(pattern, re.UNICODE)
+        except re.error as e:
+            if module_name == 're':
+                raise
+
+            # e.g. re2 does not support backreferences
+            self.echomsg('wilder: falling back to re, ' + module_name + ' failed to compile pattern: ' + str(e))
+            return self.compile_pattern('re', pattern)
 
     def run_in_background(self, fn, args):
         event = threading.Event()
         ctx = args[0]
 
-        old_events = []
+        old_events = None
         with self.events_lock:
             run_id = ctx['run_id']
             if run_id < self.run_id:
@@ -72,12 +95,12 @@ class Wilder(object):
             if run_id > self.run_id:
                 self.run_id = run_id
                 old_events = self.events
-                self.events = []
+                self.events = deque()
 
             self.events.append(event)
 
-        for ev in old_events:
-            ev.set()
+        while old_events:
+            old_events.popleft().set()
 
         return self.executor.submit(functools.partial( fn, *([event] + args), ))
 
@@ -242,8 +265,8 @@ class Wilder(object):
 
     @neovim.function('_wilder_python_search', sync=False, allow_nested=True)
     def _search(self, args):
-        bufnr = self.nvim.current.buffer.number
-        undotree_seq_cur = self.nvim.eval('undotree().seq_cur')
+        # a single request to check if the cached buffer is still valid
+        bufnr, undotree_seq_cur = self.nvim.eval('[bufnr("%"), undotree().seq_cur]')
         if (bufnr != self.cached_buffer['bufnr'] or
                 undotree_seq_cur != self.cached_buffer['undotree_seq_cur']):
             self.cached_buffer = {
@@ -269,9 +292,28 @@ class Wilder(object):
         module_name = opts['engine'] if 'engine' in opts else 're'
         max_candidates = opts['max_candidates'] if 'max_candidates' in opts else 300
 
-        re = importlib.import_module(module_name)
-        # re2 does not use re.UNICODE by default
-        pattern = re.compile(x, re.UNICODE)
+        pattern = self.compile_pattern(module_name, x)
+
+        if max_candidates <= 0:
+            # no limit, so collect and deduplicate the matches in chunks
+            # without going back to Python for every match. findall() can't
+            # be used as it returns the groups instead of the whole match
+            matches = itertools.chain.from_iterable(map(pattern.finditer, buf))
+            candidates = map(operator.methodcaller('group'), matches)
+
+            res = dict()
+            while True:
+                if event.is_set():
+                    return
+
+                chunk = list(itertools.islice(candidates, 1024))
+                if not chunk:
+                    break
+
+                res.update(dict.fromkeys(chunk))
+
+            yield from res
+            return
 
         seen = set()
         checker = EventChecker(event)
@@ -296,10 +338,8 @@ class Wilder(object):
         if event.is_set():
             return
 
-        seen = set()
-
         try:
-            res = [x for x in candidates if not (x in seen or seen.add(x))]
+            res = list(dict.fromkeys(candidates))
             self.resolve(ctx, res)
         except Exception as e:
             self.reject(ctx, 'python_uniq_filt: ' + str(e))
@@ -325,8 +365,8 @@ class Wilder(object):
         expand_arg = args[1]
         expand_type = args[2]
 
-        cwd = self.nvim.eval('getcwd()')
-        wildignore_opt = self.nvim.eval('&wildignore')
+        # fetch everything in a single request to avoid extra round trips
+        cwd, wildignore_opt, path_opt, buf_head = self.nvim.eval('[getcwd(), &wildignore, &path, expand("%:h")]')
 
         add_dot = False
 
@@ -342,9 +382,8 @@ class Wilder(object):
                         directories = [cwd]
 
             if not directories:
-                path_opt = self.nvim.eval('&path')
                 directories = path_opt.split(',')
-                directories += [self.nvim.eval('expand("%:h")')]
+                directories += [buf_head]
         elif expand_type == 'shellcmd':
             directories = []
             if expand_arg:
@@ -380,7 +419,14 @@ class Wilder(object):
 
         try:
             res = set()
-            wildignore_list = wildignore_opt.split(',')
+            wildignore_list = [p for p in wildignore_opt.split(',') if p]
+            # fnmatch.fnmatch() translates each glob on every call, combine
+            # them into a single regex instead
+            wildignore_re = None
+            if wildignore_list:
+                wildignore_re = re.compile('|'.join(
+                    fnmatch.translate(os.path.normcase(p)) for p in wildignore_list))
+            path_prefix = os.path.normpath(path_prefix)
 
             checker = EventChecker(event)
             for directory in directories:
@@ -395,8 +441,13 @@ class Wilder(object):
                     pattern = ''
                     wildcard = os.path.join(directory, expand_arg)
                     wildcard = os.path.expandvars(wildcard)
+                    directory_prefix = os.path.join(directory, '')
 
-                    it = glob.iglob(wildcard, recursive=True)
+                    walk_root = self.get_walk_root(wildcard)
+                    if walk_root is not None:
+                        it = self.walk(event, walk_root, show_hidden)
+                    else:
+                        it = glob.iglob(wildcard, recursive=True)
                 else:
                     if add_dot:
                         path = os.path.join('.', directory, expand_arg)
@@ -405,6 +456,7 @@ class Wilder(object):
                     head, tail = os.path.split(path)
                     show_hidden = tail.startswith('.')
                     pattern = tail + '*'
+                    pattern_re = re.compile(fnmatch.translate(os.path.normcase(pattern)))
 
                     try:
                         it = os.scandir(head)
@@ -417,45 +469,56 @@ class Wilder(object):
                     if checker.check():
                         return
                     try:
+                        # glob.iglob() yields strings, os.scandir() and
+                        # self.walk() yield DirEntry objects
+                        if isinstance(entry, str):
+                            dir_entry = None
+                            full_path = entry
+                            is_dir = os.path.isdir(full_path)
+                        else:
+                            dir_entry = entry
+                            full_path = entry.path
+                            is_dir = entry.is_dir()
+
                         if has_wildcard:
-                            entry = Path(entry)
-                            try:
-                                entry = entry.relative_to(directory)
-                                old_entry = Path(entry)
-                            except ValueError:
-                                pass
-                        if entry.name.startswith('.') and not show_hidden:
+                            # plain string operations, constructing a Path
+                            # for every entry is slow on large trees
+                            entry = full_path
+                            if entry.startswith(directory_prefix):
+                                entry = entry[len(directory_prefix):]
+                            entry = os.path.normpath(entry)
+                            name = os.path.basename(entry)
+                        else:
+                            name = entry.name
+
+                        if name.startswith('.') and not show_hidden:
                             continue
-                        if expand_type == 'dir' and not entry.is_dir():
+                        if expand_type == 'dir' and not is_dir:
                             continue
-                        ignore = False
-                        for wildignore in wildignore_list:
-                            if fnmatch.fnmatch(entry.name, wildignore):
-                                ignore = True
-                                break
-                        if ignore:
+                        normcase_name = os.path.normcase(name)
+                        if wildignore_re is not None and wildignore_re.match(normcase_name):
                             continue
-                        if not has_wildcard and pattern and not fnmatch.fnmatch(entry.name, pattern):
+                        if not has_wildcard and pattern and not pattern_re.match(normcase_name):
                             continue
-                        if expand_type == 'shellcmd' and entry.is_file():
-                            if has_wildcard and not entry.stat().st_mode & stat.S_IXUSR:
-                                continue
-                            elif not has_wildcard and not os.access(entry, os.X_OK):
+                        if expand_type == 'shellcmd':
+                            is_file = dir_entry.is_file() if dir_entry is not None else os.path.isfile(full_path)
+                            if is_file and not os.access(full_path, os.X_OK):
                                 continue
-                        if has_wildcard and Path(entry) == Path(path_prefix):
+                        if has_wildcard and entry == path_prefix:
                             continue
 
-                        if entry.is_dir():
-                            res.add((str(entry) if has_wildcard else entry.name) + os.sep)
+                        if is_dir:
+                            res.add((entry if has_wildcard else name) + os.sep)
                         else:
-                            res.add(str(entry) if has_wildcard else entry.name)
+                            res.add(entry if has_wildcard else name)
                     except OSError:
                         pass
+            # completions are shown in this order unless a sorter is used
             res = sorted(res)
 
             head = os.path.dirname(expand_arg)
-            if not has_wildcard:
-                res = list(map(lambda f: os.path.join(head, f) if head else f, res))
+            if not has_wildcard and head:
+                res = [os.path.join(head, f) for f in res]
 
             if expand_arg == '.':
                 res.insert(0, '../')
@@ -467,6 +530,51 @@ class Wilder(object):
         except Exception as e:
             self.reject(ctx, 'python_get_file_completion: ' + str(e))
 
+    # Returns the directory to walk if wildcard is of the form dir/**/*,
+    # otherwise returns None
+    def get_walk_root(self, wildcard):
+        for suffix in {'/**/*', os.sep + '**' + os.sep + '*'}:
+            if wildcard.endswith(suffix):
+                root = wildcard[:-len(suffix) + 1]
+                if not glob.has_magic(root):
+                    return root
+        return None
+
+    # Equivalent to glob.iglob(os.path.join(root, '**', '*'), recursive=True)
+    # but yields DirEntry objects. Symlinked directories are followed like
+    # glob does, except when they point back to a directory being walked
+    def walk(self, event, root, show_hidden, ancestors=None):
+        if event.is_set():
+            return
+
+        try:
+            if ancestors is None:
+                root_stat = os.stat(root)
+                ancestors = frozenset([(root_stat.st_dev, root_stat.st_ino)])
+            it = os.scandir(root)
+        except OSError:
+            return
+
+        with it:
+            for entry in it:
+                if not show_hidden and entry.name.startswith('.'):
+                    continue
+
+                yield entry
+
+                try:
+                    if not entry.is_dir():
+                        continue
+                    entry_stat = entry.stat()
+                except OSError:
+                    continue
+
+                key = (entry_stat.st_dev, entry_stat.st_ino)
+                if key in ancestors:
+                    continue
+
+                yield from self.walk(event, entry.path, show_hidden, ancestors | {key})
+
     # Returns True if p2 is a descendant of p1
     def is_descendant_path(self, p1, p2):
         return os.path.relpath(p2, p1)[0:2] != '..'
@@ -614,18 +722,28 @@ class Wilder(object):
             return
 
         try:
-            res = []
-
-            pwd = importlib.import_module('pwd')
-            for user in pwd.getpwall():
-                if user.pw_name.startswith(expand_arg):
-                    res.append(user.pw_name)
-
-            res = sorted(res)
+            res = sorted(u for u in self.get_users() if u.startswith(expand_arg))
             self.resolve(ctx, res)
         except Exception as e:
             self.reject(ctx, 'python_get_users: ' + str(e))
 
+    # pwd.getpwall() is cached for a few seconds, or until /etc/passwd changes
+    def get_users(self, ttl_s=5):
+        with self.users_lock:
+            try:
+                mtime = os.stat('/etc/passwd').st_mtime
+            except OSError:
+                mtime = -1
+
+            now = time.time()
+            if now - self.users_timestamp >= ttl_s or mtime != self.users_mtime:
+                pwd = importlib.import_module('pwd')
+                self.users = [user.pw_name for user in pwd.getpwall()]
+                self.users_timestamp = now
+                self.users_mtime = mtime
+
+            return self.users
+
     @neovim.function('_wilder_python_fuzzy_filt', sync=False, allow_nested=True)
     def _fuzzy_filt(self, args):
         self.run_in_background(self.fuzzy_filt_handler, args)
@@ -683,9 +801,7 @@ class Wilder(object):
 
     def fuzzy_filt(self, event, opts, candidates, pattern):
         engine = opts['engine'] if 'engine' in opts else 're'
-        re = importlib.import_module(engine)
-        # re2 does not use re.UNICODE by default
-        pattern = re.compile(pattern, re.UNICODE)
+        pattern = self.compile_pattern(engine, pattern)
 
         checker = EventChecker(event)
         for candidate in candidates:
@@ -830,11 +946,31 @@ class Wilder(object):
         except Exception as e:
             self.reject(ctx, 'python_fuzzywuzzy_sort: ' + str(e))
 
+    # rapidfuzz is a faster drop-in replacement for fuzzywuzzy
+    # Returns the fuzz module and rapidfuzz.process, or None for fuzzywuzzy
+    @functools.lru_cache(maxsize=None)
+    def import_fuzz(self):
+        if find_spec('rapidfuzz'):
+            return (importlib.import_module('rapidfuzz.fuzz'),
+                    importlib.import_module('rapidfuzz.process'),)
+        return (importlib.import_module('fuzzywuzzy.fuzz'), None,)
+
     def fuzzywuzzy_sort(self, event, opts, candidates, query):
-        fuzzy = importlib.import_module('fuzzywuzzy.fuzz')
+        fuzzy, process = self.import_fuzz()
         partial = opts['partial'] if 'partial' in opts else True
         ratio = fuzzy.partial_ratio if partial else fuzzy.ratio
 
+        if process is not None:
+            if event.is_set():
+                return []
+
+            # scores all candidates in a single native call, ties keep
+            # their original order
+            # rapidfuzz < 3.0 lowercases and strips the strings by default,
+            # fuzzywuzzy does not
+            matches = process.extract(query, candidates, scorer=ratio, processor=None, limit=None)
+            return [match[0] for match in matches]
+
         xs = [None] * len(candidates)
         checker = EventChecker(event)
         for index, candidate in enumerate(candidates):
@@ -895,6 +1031,9 @@ class Wilder(object):
         if not match or not match.lastindex:
             return 0
 
+        # character indexes are byte offsets for ASCII strings
+        is_ascii = string.isascii()
+
         captures = []
         for i in range(1, match.lastindex + 1):
             start = match.start(i)
@@ -902,6 +1041,10 @@ class Wilder(object):
             if start == -1 or end == -1 or start == end:
                 continue
 
+            if is_ascii:
+                captures.append([start, end - start])
+                continue
+
             byte_start = len(string[: start].encode('utf-8'))
             byte_len = len(string[start : end].encode('utf-8'))
             captures.append([byte_start, byte_len])